@@ -65,6 +65,14 @@ class Conf(_config.ConfigNamespace):
     autosave_fftw_wisdom = _config.ConfigItem(True, 'Should POPPY ' +
                                               'automatically save and reload FFTW ' +
                                               '"wisdom" for improved speed?')
+    fftw_planner_effort = _config.ConfigItem(['FFTW_PATIENT', 'FFTW_MEASURE', 'FFTW_EXHAUSTIVE', 'FFTW_ESTIMATE'],
+                                             'Planner effort for FFTW. More effort takes longer ' +
+                                             'to plan the first transform of each array size, for faster FFTs ' +
+                                             'afterwards. That first-call cost is paid for each array shape, ' +
+                                             'direction, precision and batch size; with FFTW_PATIENT it can be ' +
+                                             'tens of seconds for a 1024x1024 array, versus under a second ' +
+                                             'with FFTW_MEASURE. With autosave_fftw_wisdom, that planning ' +
+                                             'is reused across sessions.')
 
     use_cuda = _config.ConfigItem(True, 'Use cuda for FFTs on GPU (assuming it' +
             'is available)?')
@@ -72,9 +80,13 @@ class Conf(_config.ConfigNamespace):
             'is available)?')
     use_numexpr = _config.ConfigItem(True, 'Use NumExpr to accelarate array math (assuming it' +
             'is available)?')
+    use_numba = _config.ConfigItem(True, 'Use Numba to accelerate array math on the CPU (assuming it' +
+            'is available)?')
 
-    double_precision = _config.ConfigItem(True, 'Floating point values use float64 and complex128 if True,' +
-            'otherwise float32 and complex64.')
+    double_precision = _config.ConfigItem(False, 'Floating point values use float64 and complex128 if True, ' +
+            'otherwise float32 and complex64. Single precision is sufficient for most diffraction ' +
+            'calculations, and halves memory use and traffic; enable this for calculations which need ' +
+            'more accuracy, such as propagation over very long distances.')
 
     default_image_display_fov = _config.ConfigItem(5.0, 'Default image' +
                                                    'display field of view, in arcseconds. Adjust this to display ' +
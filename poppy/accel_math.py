@@ -4,6 +4,12 @@
 #
 import numpy as np
 import multiprocessing
+import os
+import threading
+import atexit
+import collections
+import ctypes
+import math
 from . import conf
 
 import time
@@ -16,6 +22,9 @@ try:
     import pyfftw
     # Setup infrastructure for FFTW
     _FFTW_INIT = {}  # dict of array sizes for which we have already performed the required FFTW planning step
+    _FFTW_PLAN_LOCK = threading.Lock()  # serializes FFTW planning, which is not thread safe
+    _FFTW_PLANNED = False  # have any FFTW plans been made in this session?
+    _FFTW_PLAN_CACHE_MAX = 8  # max number of plans to keep per thread; least recently used ones are freed beyond this
     _FFTW_FLAGS = ['measure']
     _FFTW_AVAILABLE = True
 except ImportError:
@@ -25,6 +34,9 @@ except ImportError:
 try:
     # try to import numexpr package to see if it is available
     import numexpr as ne
+    # numexpr by default uses at most 8 threads; use all the cores unless told otherwise
+    if 'NUMEXPR_NUM_THREADS' not in os.environ:
+        ne.set_num_threads(min(multiprocessing.cpu_count(), ne.MAX_THREADS))
 
     _NUMEXPR_AVAILABLE = True
 except ImportError:
@@ -32,13 +44,32 @@ except ImportError:
     _NUMEXPR_AVAILABLE = False
 
 try:
-    # try to import CUDA packages to see if they are available
-    import pyculib
+    # try to import numba package to see if it is available
+    from numba import njit, prange
+
+    _NUMBA_AVAILABLE = True
+except ImportError:
+    _NUMBA_AVAILABLE = False
+
+try:
+    # try to import CUDA packages and the cuFFT library to see if they are available
     from numba import cuda
-    _CUDA_PLANS = {} # plans for various array sizes already prepared
+    from numba.cuda.cudadrv.libs import open_cudalib
+    if not cuda.is_available():
+        raise ImportError("No CUDA GPU or driver available")
+    _CUDA_PLANS = collections.OrderedDict()  # LRU cache of plans for various array sizes already prepared
+    _CUDA_PLAN_CACHE_MAX = 16  # max number of plans to keep; least recently used ones are freed beyond this
+    _CUDA_WORKAREA = None  # single GPU scratch buffer shared by all cached plans
+    _CUDA_BUFFERS = collections.OrderedDict()  # LRU cache of pinned host and GPU arrays for each array size
+    _CUDA_STATE = dict(libcufft=open_cudalib('cufft'))  # ctypes handle to the cuFFT library, and CUDA stream
+    # cuFFT transform types, and the functions executing them, for each complex dtype
+    _CUFFT_TYPES = {np.dtype(np.complex64): (0x29, 'cufftExecC2C'),
+                    np.dtype(np.complex128): (0x69, 'cufftExecZ2Z')}
+    _CUFFT_FORWARD = -1
+    _CUFFT_INVERSE = 1
     _CUDA_AVAILABLE = True
-except ImportError:
-    pyculib = None
+except (ImportError, OSError):
+    cuda = None
     _CUDA_AVAILABLE = False
 
 try:
@@ -48,22 +79,32 @@ try:
     import gpyfft
     _OPENCL_AVAILABLE = True
     _OPENCL_STATE = dict()
+    _OPENCL_PLANS = collections.OrderedDict()  # LRU cache of clFFT transforms and their GPU arrays for each array size
+    _OPENCL_PINNED = collections.OrderedDict()  # LRU cache of pinned host arrays for each array size
+    _OPENCL_CACHE_MAX = 16  # max number of array sizes to keep; least recently used ones are freed beyond this
 except ImportError:
     _OPENCL_AVAILABLE = False
 
+_NUMPY_FFT_INPLACE = np.lib.NumpyVersion(np.__version__) >= '2.0.0'  # numpy.fft functions accept out= ?
+_R_NUMBA_MAX_SIZE = 1 << 18  # arrays smaller than this are faster in Numba than in Numexpr, for _r
+_THREAD_STATE = threading.local()  # caches of plans private to each thread; see _thread_cache
+_GPU_LOCK = threading.Lock()  # serializes GPU FFTs, which share cached device and pinned host arrays
+
 _USE_CUDA = (conf.use_cuda and _CUDA_AVAILABLE)
 _USE_OPENCL = (conf.use_opencl and _OPENCL_AVAILABLE)
 _USE_NUMEXPR = (conf.use_numexpr and _NUMEXPR_AVAILABLE)
+_USE_NUMBA = (conf.use_numba and _NUMBA_AVAILABLE)
 _USE_FFTW = (conf.use_fftw and _FFTW_AVAILABLE)
 
 
 def update_math_settings():
     """ Update the module-level math flags, based on user settings
     """
-    global _USE_CUDA, _USE_OPENCL, _USE_NUMEXPR, _USE_FFTW
+    global _USE_CUDA, _USE_OPENCL, _USE_NUMEXPR, _USE_NUMBA, _USE_FFTW
     _USE_CUDA = (conf.use_cuda and _CUDA_AVAILABLE)
     _USE_OPENCL = (conf.use_opencl and _OPENCL_AVAILABLE)
     _USE_NUMEXPR = (conf.use_numexpr and _NUMEXPR_AVAILABLE)
+    _USE_NUMBA = (conf.use_numba and _NUMBA_AVAILABLE)
     _USE_FFTW = (conf.use_fftw and _FFTW_AVAILABLE)
 
 
@@ -80,9 +121,17 @@ def _complex():
 
 
 def _r(x, y):
-    """ Function to speed up computing the radius given x and y, using Numexpr if available
-    Otherwise defaults to numpy. """
-    if _USE_NUMEXPR:
+    """ Function to speed up computing the radius given x and y, using Numba or Numexpr if available
+    Otherwise defaults to numpy.
+
+    Numexpr's thread dispatch costs more than it gains for smaller arrays, so
+    Numba is preferred for those, and Numexpr only for large arrays."""
+    if (_USE_NUMBA and (not _USE_NUMEXPR or np.size(x) < _R_NUMBA_MAX_SIZE) and
+            isinstance(x, np.ndarray) and isinstance(y, np.ndarray) and x.ndim == 2 and x.shape == y.shape):
+        out = np.empty(x.shape, dtype=np.result_type(x, y, 1.0))
+        _numba_call(_r_numba, x, y, out)
+        return out
+    elif _USE_NUMEXPR:
         return ne.evaluate("sqrt(x**2+y**2)")
     else:
         return np.sqrt(x ** 2 + y ** 2)
@@ -99,53 +148,147 @@ def _exp(x):
     else:
         return np.exp(x)
 
-def _fftshift(x):
-    """ FFT shifts of array contents, using CUDA if available.
+def _quadphase(x, y, c):
+    """ Compute the quadratic phase exp(i * c * (x**2 + y**2)), using Numexpr if available.
     Otherwise defaults to numpy.
 
+    Numexpr evaluates this in a single pass over the arrays, rather than one
+    pass and one temporary array per each arithmetic operation.
+    """
+    if _USE_NUMEXPR:
+        # numexpr only computes complex values in double precision, so cast to the configured one
+        return np.asarray(ne.evaluate("exp(1j * c * (x * x + y * y))"), _complex())
+    else:
+        return np.asarray(np.exp(1j * c * (x ** 2 + y ** 2)), _complex())
+
+
+def _fftshift(x, scale=None):
+    """ FFT shifts of array contents, using CUDA if available.
+    Otherwise defaults to numpy. Unlike numpy's fftshift, the input array is shifted in place
+    where possible, including for all even-sized 2D arrays when Numba or CUDA is used, so
+    always use the returned array, and pass a copy if the unshifted input is still needed.
+
+    If a scale factor is given, the array is multiplied by it in the same pass.
+
     Note - TODO write an OpenCL version
 
     See also ifftshift
     """
 
-    N=x.shape[0]
-    # the CUDA fftshift is set up to work on blocks of 32, so
-    # N must be a multiple of 32. We check this rapidly using a bit mask:
-    #    (x & 31)==0  is a ~20x faster equivalent of (np.mod(x,32)==0)
-    if (_USE_CUDA) & (N==x.shape[1]) & ((N & 31)==0):
-        blockdim = (32, 32) # threads per block
-        numBlocks = (int(N/blockdim[0]),int(N/blockdim[1]))
-        cufftShift_2D_kernel[numBlocks, blockdim](x.ravel(),N)
-        return x
+    if _USE_CUDA and np.ndim(x) == 2:
+        return _cuda_shift(x, inverse=False, scale=scale)
     else:
-        return np.fft.fftshift(x)
+        return _shift_numpy(x, inverse=False, scale=scale)
 
-def _ifftshift(x):
+def _ifftshift(x, scale=None):
     """ Inverse FFT shifts of array contents, using CUDA if available.
-    Otherwise defaults to numpy.
+    Otherwise defaults to numpy. Unlike numpy's ifftshift, the input array is shifted in place
+    where possible, including for all even-sized 2D arrays when Numba or CUDA is used, so
+    always use the returned array, and pass a copy if the unshifted input is still needed.
+
+    If a scale factor is given, the array is multiplied by it in the same pass.
     Note, ifftshift and fftshift are identical for even-length x,
-    the functions differ by one sample for odd-length x. This function
-    implictly assumes that if using CUDA, the array size must be even,
-    so we can use the same algorithm as fftshift.
+    the functions differ by one sample for odd-length x.
 
     Note - TODO write an OpenCL version
 
     See also fftshift
     """
 
-    N=x.shape[0]
-    # the CUDA fftshift is set up to work on blocks of 32, so
-    # N must be a multiple of 32. We check this rapidly using a bit mask:
-    #   not (x & 31)  is a ~20x faster equivalent of (np.mod(x,32)==0)
-    if (_USE_CUDA) & (N==x.shape[1]) & ((N & 31)==0):
-        blockdim = (32, 32) # threads per block
-        numBlocks = (int(N/blockdim[0]),int(N/blockdim[1]))
-        cufftShift_2D_kernel[numBlocks, blockdim](x.ravel(),N)
-        return x
+    if _USE_CUDA and np.ndim(x) == 2:
+        return _cuda_shift(x, inverse=True, scale=scale)
+    else:
+        return _shift_numpy(x, inverse=True, scale=scale)
+
+
+def _cuda_shift(x, inverse=False, scale=None):
+    """ FFT shift or inverse FFT shift a 2D array of any size on the GPU,
+    optionally also multiplying it by a scale factor.
+
+    For even array dimensions the shift is just a swap of quadrants, done in place.
+    Otherwise it is a cyclic shift done via a scratch array on the GPU.
+    """
+    ny, nx = x.shape
+    scale = 1.0 if scale is None else scale
+    blockdim = (16, 16) # threads per block
+    # the kernels work on the array memory as laid out in C order
+    x = np.ascontiguousarray(x)
+    if (ny & 1) == 0 and (nx & 1) == 0:
+        # Each thread swaps one element in the top half of the array with its partner in the
+        # bottom half, so only launch threads covering the top half.
+        numBlocks = ((nx + blockdim[0] - 1) // blockdim[0], (ny // 2 + blockdim[1] - 1) // blockdim[1])
+        cufftShift_2D_kernel[numBlocks, blockdim](x, scale)
     else:
-        return np.fft.ifftshift(x)
+        # Shift by half the size rounded down for fftshift, or rounded up for ifftshift.
+        shift_y, shift_x = ((ny + 1) // 2, (nx + 1) // 2) if inverse else (ny // 2, nx // 2)
+        x_on_gpu = cuda.to_device(x)
+        shifted_on_gpu = cuda.device_array_like(x_on_gpu)
+        numBlocks = ((nx + blockdim[0] - 1) // blockdim[0], (ny + blockdim[1] - 1) // blockdim[1])
+        cufftShift_2D_roll_kernel[numBlocks, blockdim](x_on_gpu, shifted_on_gpu, shift_y, shift_x, scale)
+        shifted_on_gpu.copy_to_host(x)
+    return x
+
+
+def _shift_numpy(x, inverse=False, scale=None):
+    """ FFT shift or inverse FFT shift an array on the CPU,
+    optionally also multiplying it by a scale factor.
+
+    For even array dimensions, where the shift just swaps quadrants, Numba is used
+    if available to swap them in place. Otherwise a 2D array is cyclically shifted by
+    copying its four blocks into a new array, multiplying by the scale factor in the same pass.
+    """
+    if not isinstance(x, np.ndarray) or x.ndim != 2:
+        result = np.fft.ifftshift(x) if inverse else np.fft.fftshift(x)
+        return result if scale is None else result * scale
+
+    ny, nx = x.shape
+    if _USE_NUMBA and (ny & 1) == 0 and (nx & 1) == 0 and x.flags.writeable:
+        # fftshift and ifftshift are identical for even sizes
+        if scale is None:
+            _numba_call(_inplace_quadswap_unscaled, x)
+        else:
+            _numba_call(_inplace_quadswap, x, scale)
+        return x
+
+    # Shift by half the size rounded down for fftshift, or rounded up for ifftshift.
+    shift_y, shift_x = ((ny + 1) // 2, (nx + 1) // 2) if inverse else (ny // 2, nx // 2)
+    # (destination, source) slices along each axis
+    rows = ((slice(shift_y, None), slice(None, ny - shift_y)), (slice(None, shift_y), slice(ny - shift_y, None)))
+    cols = ((slice(shift_x, None), slice(None, nx - shift_x)), (slice(None, shift_x), slice(nx - shift_x, None)))
+    result = np.empty_like(x)
+    for dest_rows, src_rows in rows:
+        for dest_cols, src_cols in cols:
+            if scale is None:
+                result[dest_rows, dest_cols] = x[src_rows, src_cols]
+            else:
+                np.multiply(x[src_rows, src_cols], scale, out=result[dest_rows, dest_cols])
+    return result
 
 
+def _numba_call(kernel, *args):
+    """ Run a parallel Numba kernel from the main thread, or its serial version from any other thread.
+
+    Numba's parallel kernels can't safely be launched from other threads: its workqueue
+    threading layer, used when neither TBB nor OpenMP is installed, aborts the whole process
+    on concurrent launches, and with TBB the process can hang on exit. Calls from other
+    threads, such as a thread pool, already run concurrently, so lose little by running serially.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        kernel = _NUMBA_SERIAL[kernel]
+    return kernel(*args)
+
+
+def _thread_cache(name):
+    """ Retrieve an OrderedDict, for caching plans via _lru_cached, which is private to the calling thread.
+
+    This lets several threads run FFTs concurrently without sharing any plan arrays.
+    """
+    try:
+        return getattr(_THREAD_STATE, name)
+    except AttributeError:
+        cache = collections.OrderedDict()
+        setattr(_THREAD_STATE, name, cache)
+        return cache
 
 
 def fft_2d(wavefront, forward=True, normalization=None, fftshift=True):
@@ -160,120 +303,270 @@ def fft_2d(wavefront, forward=True, normalization=None, fftshift=True):
     (and some minor related logging) .
     All the interaction with object state for Wavefront arrays should happen elsewhere.
 
-    TODO: this should execute an IN PLACE FFT, so we don't have to pass around arrays to return
-    anything.
+    The FFT is performed in place, overwriting the input array, for all methods except
+    numpy versions before 2.0, which cannot transform in place. Either way, callers
+    should use the returned array.
+
+    This function is thread safe, so FFTs of different arrays may be run concurrently from
+    several threads, e.g. via concurrent.futures.ThreadPoolExecutor. FFTW plans are kept
+    separately for each thread, and the GIL is released while FFTW, Numba, and Numexpr compute,
+    so those calculations overlap. Numba kernels called from threads other than the main thread
+    run serially, since Numba's parallel kernels can't safely be launched from them.
+    GPU FFTs share device resources, and are run one at a time.
 
     Parameters
     -----------
+    wavefront : ndarray
+        2D array to transform. A 3D stack of arrays transformed over the last two
+        axes is also accepted; see fft_2d_batch.
     forward : bool
         set to True for forward FFT, False for inverse fft
     normalization : float, optional
-        Normalization factor. Defaults to 1./wavefront.shape[0] for forward,
-        and wavefront.shape[0] for inverse. Use this only if you need a non-default
+        Normalization factor. Defaults to 1./wavefront.shape[-2] for forward,
+        and wavefront.shape[-2] for inverse. Use this only if you need a non-default
         behavior.
     fftshift : bool
         apply FFT shift after forwards FFT or before inverse FFT?
 
     """
-    ## To use a fast FFT, it must both be enabled and the library itself has to be present
-    global _USE_OPENCL, _USE_CUDA # need to declare global in case we need to change it, below
-    t0 = time.time()
-
-    # OpenCL cfFFT only can FFT certain array sizes.
-    if _USE_OPENCL and not isproductofsmallprimes(wavefront.shape[0]):
-        _log.debug(("Wavefront size {} not supported by OpenCL, therefore disabling "+
-            "USE_OPENCL for this calculation.").format(wavefront.shape))
-        _USE_OPENCL = False
-
-    # This annoyingly complicated if/elif is just for the debug print statement
-    if _USE_CUDA:
-        method = 'pyculib (CUDA GPU)'
-    elif _USE_OPENCL:
-        method = 'pyopencl (OpenCL GPU)'
-    elif _USE_FFTW:
-        method = 'pyfftw'
-    else:
-        method = 'numpy'
-    _log.debug("using {2} FFT of {0} array, FFT_direction={1}".format(
-        str(wavefront.shape), 'forward' if forward else 'backward', method))
-
+    ## To use a fast FFT, it must both be enabled and the library itself has to be present.
+    ## Those are resolved from the configuration in update_math_settings, not on every call.
+    debug = _log.isEnabledFor(logging.DEBUG)
+    if debug:
+        t0 = time.time()
+
+    # OpenCL cfFFT only can FFT certain array sizes. Fall back to another method
+    # for just this calculation; later calls of a supported size still use OpenCL.
+    use_opencl = _USE_OPENCL and not _USE_CUDA
+    if use_opencl and not (isproductofsmallprimes(wavefront.shape[-2]) and
+                           isproductofsmallprimes(wavefront.shape[-1])):
+        _log.debug("Wavefront size %s not supported by OpenCL, therefore not using OpenCL for this calculation.",
+                   wavefront.shape)
+        use_opencl = False
+
+    if debug:
+        # This annoyingly complicated if/elif is just for the debug print statement
+        if _USE_CUDA:
+            method = 'cuFFT (CUDA GPU)'
+        elif use_opencl:
+            method = 'pyopencl (OpenCL GPU)'
+        elif _USE_FFTW:
+            method = 'pyfftw'
+        else:
+            method = 'numpy'
+        _log.debug("using %s FFT of %s array, FFT_direction=%s",
+                   method, wavefront.shape, 'forward' if forward else 'backward')
+
+    if normalization is None:
+        # cuFFT inverse transforms are unnormalized, unlike the others, so the same factor serves both directions
+        normalization = 1./wavefront.shape[-2] if (forward or _USE_CUDA) else wavefront.shape[-2]
+    if _USE_FFTW and not (forward or _USE_CUDA or use_opencl):
+        # Apply FFTW's inverse normalization together with ours, rather than letting it
+        # make a separate pass over the array.
+        normalization /= wavefront.shape[-2] * wavefront.shape[-1]
+
+    # Multiplying by the normalization factor is folded into the FFT shift, if there is one,
+    # to avoid another whole pass over the array just for that.
     if (not forward) and fftshift: #inverse shift before backwards FFTs
-        wavefront = _ifftshift(wavefront)
+        wavefront = _shift_planes(wavefront, inverse=True, scale=normalization)
 
-    t1 = time.time()
+    if debug:
+        t1 = time.time()
     if _USE_CUDA:
-        if normalization is None:
-            normalization = 1./wavefront.shape[0]  # regardless of direction, for CUDA
-
-        # We need a CUDA FFT plan for each size and shape of FFT.
-        # The plans can be cached for reuse, since they cost some
-        # 10s of milliseconds to create
-        params = (wavefront.shape, wavefront.dtype, wavefront.dtype)
-        try:
-            cufftplan = _CUDA_PLANS[params]
-        except KeyError:
-            cufftplan = pyculib.fft.FFTPlan(*params)
-            _CUDA_PLANS[params] = cufftplan
-
-        # perform FFT on GPU, and return results in place to same array.
-        if forward:
-            cufftplan.forward(wavefront, out=wavefront)
+        with _GPU_LOCK:
+            # We need a CUDA FFT plan for each size and shape of FFT, which serves both directions.
+            # The plans can be cached for reuse, since they cost some
+            # 10s of milliseconds to create. The cache is bounded, dropping the least
+            # recently used plan, so that cycling through many array sizes doesn't exhaust GPU memory.
+            # A 3D stack of arrays is done as a batch of 2D transforms using a single plan.
+            batch = wavefront.shape[0] if wavefront.ndim == 3 else 1
+            cufftplan, exec_func = _get_cuda_plan(wavefront.shape[-2:], wavefront.dtype, batch)
+
+            # Stage the data through pinned host memory, and queue the transfers and FFT
+            # asynchronously on one stream, waiting only before reading the results back.
+            stream = _get_cuda_stream()
+            pinned, wf_on_gpu = _get_cuda_buffers(wavefront.shape, wavefront.dtype)
+            pinned[:] = wavefront
+            wf_on_gpu.copy_to_device(pinned, stream=stream)
+            _cufft_call(exec_func, cufftplan, wf_on_gpu.device_ctypes_pointer, wf_on_gpu.device_ctypes_pointer,
+                        _CUFFT_FORWARD if forward else _CUFFT_INVERSE)
+            wf_on_gpu.copy_to_host(pinned, stream=stream)
+            stream.synchronize()
+            wavefront[:] = pinned
+
+    elif use_opencl:
+        with _GPU_LOCK:
+            context, queue = get_opencl_context()
+            # Stage the data through pinned host memory, and queue the transfers and FFT
+            # without blocking, waiting only before reading the results back.
+            pinned = _get_opencl_pinned(wavefront.shape, wavefront.dtype)
+            pinned[:] = wavefront
+            transform, wf_on_gpu = _get_opencl_transform(wavefront.shape, wavefront.dtype)
+            pyopencl.enqueue_copy(queue, wf_on_gpu.data, pinned, is_blocking=False)
+            event, = transform.enqueue(forward=forward)
+            pyopencl.enqueue_copy(queue, pinned, wf_on_gpu.data, is_blocking=False, wait_for=[event]).wait()
+            wavefront[:] = pinned
+
+    elif _USE_FFTW:
+        FFT_direction = 'forward' if forward else 'backward' # back compatible for use in _FFTW_INIT
+        fftw_plan = _get_fftw_plan(wavefront.shape, np.result_type(wavefront.dtype, np.complex64), FFT_direction)
+        if _fftw_plan_matches(fftw_plan, wavefront):
+            # Transform the array directly, without copying it through the plan's own array.
+            plan_array = fftw_plan.input_array
+            fftw_plan.update_arrays(wavefront, wavefront)
+            # execute() applies no normalization in either direction; that for
+            # inverse FFTs is included in normalization, above.
+            fftw_plan.execute()
+            fftw_plan.update_arrays(plan_array, plan_array)  # don't keep a reference to the caller's array
+        else:
+            # The plan's SIMD code is only valid for arrays with its own alignment and strides,
+            # so anything else is copied through the plan's aligned array.
+            fftw_plan.input_array[:] = wavefront
+            fftw_plan.execute()  # unnormalized, as above
+            if wavefront.dtype == fftw_plan.output_array.dtype and wavefront.flags.writeable:
+                wavefront[:] = fftw_plan.output_array
+            else:
+                wavefront = fftw_plan.output_array.copy()
+    else: # Basic numpy FFT
+        do_fft =  np.fft.fft2 if forward else np.fft.ifft2
+        if _NUMPY_FFT_INPLACE and np.iscomplexobj(wavefront) and wavefront.flags.writeable:
+            wavefront = do_fft(wavefront, out=wavefront)
         else:
-            cufftplan.inverse(wavefront, out=wavefront)
+            wavefront = do_fft(wavefront)
+    if debug:
+        t2 = time.time()
 
-    elif _USE_OPENCL:
-        if normalization is None:
-            normalization = 1./wavefront.shape[0] if forward else wavefront.shape[0]
+    if forward and fftshift:
+        wavefront = _shift_planes(wavefront, inverse=False, scale=normalization)
+    elif not fftshift and normalization != 1:
+        wavefront *= normalization
+    if debug:
+        t3 = time.time()
+        _log.debug("    FFT_2D: FFT in %.3f s, full function  in %.3f s", t2-t1, t3-t0)
 
-        context, queue = get_opencl_context()
-        wf_on_gpu = pyopencl.array.to_device(queue, wavefront)
-        transform = gpyfft.fft.FFT(context, queue, wf_on_gpu, axes=(0,1))
-        event, = transform.enqueue(forward=forward)
-        event.wait()
-        wavefront[:] = wf_on_gpu.get()
-        del wf_on_gpu
+    return wavefront
 
-    elif _USE_FFTW:
-        FFT_direction = 'forward' if forward else 'backward' # back compatible for use in _FFTW_INIT
-        do_fft = pyfftw.interfaces.numpy_fft.fft2 if forward else pyfftw.interfaces.numpy_fft.ifft2
-        if normalization is None:
-            normalization = 1./wavefront.shape[0] if forward else wavefront.shape[0]
 
+def fft_2d_batch(wavefronts, forward=True, normalization=None, fftshift=True):
+    """ FFTs of a stack of equal-sized 2D arrays, such as the wavefronts for several
+    wavelengths on the same grid, done as one batched transform over the last two axes.
+
+    This amortizes the per-call overhead of fft_2d across the whole stack, and lets
+    FFTW and cuFFT use a single plan for all the transforms. See fft_2d for details.
 
-        if (wavefront.shape, FFT_direction) not in _FFTW_INIT:
-            # The first time you run FFTW to transform a given size, it does a speed test to
-            # determine optimal algorithm that is destructive to your chosen array.
-            # So only do that test on a copy, not the real array:
-            _log.info("Measuring pyfftw optimal plan for %s, direction=%s" % (
-                str(wavefront.shape), FFT_direction))
+    Parameters
+    -----------
+    wavefronts : ndarray
+        3D array, the stack of 2D arrays to transform
+    forward : bool
+        set to True for forward FFT, False for inverse fft
+    normalization : float, optional
+        Normalization factor. Defaults to 1./wavefronts.shape[-2] for forward,
+        and wavefronts.shape[-2] for inverse. Use this only if you need a non-default
+        behavior.
+    fftshift : bool
+        apply FFT shift after forwards FFT or before inverse FFT?
 
-            pyfftw.interfaces.cache.enable()
-            pyfftw.interfaces.cache.set_keepalive_time(30)
+    """
+    if np.ndim(wavefronts) != 3:
+        raise ValueError("fft_2d_batch requires a 3D stack of arrays; use fft_2d for a single 2D array.")
+    return fft_2d(wavefronts, forward=forward, normalization=normalization, fftshift=fftshift)
+
+
+def _shift_planes(wavefront, inverse=False, scale=None):
+    """ FFT shift or inverse FFT shift a 2D array, or each 2D plane of a 3D stack of arrays """
+    shift = _ifftshift if inverse else _fftshift
+    if wavefront.ndim == 2:
+        return shift(wavefront, scale=scale)
+    for plane in wavefront:
+        shifted = shift(plane, scale=scale)
+        if shifted is not plane:
+            plane[...] = shifted
+    return wavefront
 
-            test_array = np.zeros(wavefront.shape)
-            test_array = do_fft(test_array, overwrite_input=True, planner_effort='FFTW_MEASURE',
-                                threads=multiprocessing.cpu_count())
 
-            _FFTW_INIT[(wavefront.shape, FFT_direction)] = True
+def _lru_cached(cache, key, create, maxsize, release=None):
+    """ Retrieve an item from an OrderedDict used as a least-recently-used cache,
+    creating it via create() if not present. The least recently used item is dropped
+    to make room if the cache already holds maxsize items, and passed to release(),
+    if given, to free any resources it holds.
+    """
+    try:
+        value = cache[key]
+        cache.move_to_end(key)
+    except KeyError:
+        if len(cache) >= maxsize:
+            _, dropped = cache.popitem(last=False)
+            if release is not None:
+                release(dropped)
+        value = create()
+        cache[key] = value
+    return value
+
+
+def _get_fftw_plan(shape, dtype, direction):
+    """ Create, save, and retrieve persistent FFTW plans.
+
+    Each plan owns a byte-aligned array, which it transforms in place and which is reused
+    on every call. This avoids the overhead of the pyfftw.interfaces wrappers, which
+    re-check and re-bind arrays on each call, and the alignment allows FFTW to use its SIMD code.
 
-        wavefront = do_fft(wavefront, overwrite_input=True, planner_effort='FFTW_MEASURE',
-                                threads=multiprocessing.cpu_count())
-    else: # Basic numpy FFT
-        do_fft =  np.fft.fft2 if forward else np.fft.ifft2
-        if normalization is None:
-            normalization = 1./wavefront.shape[0] if forward else wavefront.shape[0]
-        wavefront = do_fft(wavefront)
-    t2 = time.time()
+    Parameters
+    -----------
+    shape : tuple
+        Array shape
+    dtype : numpy.dtype
+        Complex data type of the arrays
+    direction : string
+        'forward' or 'backward'
+    """
+    def make_plan():
+        global _FFTW_PLANNED
+        with _FFTW_PLAN_LOCK:
+            if not _FFTW_PLANNED and conf.autosave_fftw_wisdom:
+                # first plan of this session; reuse planning from any previous sessions
+                from . import utils
+                utils.fftw_load_wisdom()
+
+            if (shape, direction) not in _FFTW_INIT:
+                # The first time you run FFTW to transform a given size, it does a speed test to
+                # determine optimal algorithm that is destructive to your chosen array.
+                # That test is done on the plan's own arrays, which only hold data during a transform.
+                _log.info("Measuring pyfftw optimal plan for %s, direction=%s" % (str(shape), direction))
+
+            array = pyfftw.empty_aligned(shape, dtype=dtype)
+            fftw_plan = pyfftw.FFTW(array, array, axes=(-2, -1),
+                                    direction='FFTW_FORWARD' if direction == 'forward' else 'FFTW_BACKWARD',
+                                    flags=(conf.fftw_planner_effort, 'FFTW_DESTROY_INPUT'),
+                                    threads=multiprocessing.cpu_count())
+            _FFTW_PLANNED = True
+            _FFTW_INIT[(shape, direction)] = True
+        return fftw_plan
+
+    # Each plan holds a full-size array, so only the most recently used few are kept.
+    return _lru_cached(_thread_cache('fftw_plans'), (shape, dtype, direction), make_plan, _FFTW_PLAN_CACHE_MAX)
+
+
+def _fftw_plan_matches(fftw_plan, array):
+    """ Can this FFTW plan transform the given array in place, directly?
+
+    Plans are made for their own byte-aligned, contiguous arrays, and FFTW may only execute
+    them on other arrays of the same dtype, strides, and alignment.
+    """
+    plan_array = fftw_plan.input_array
+    return (isinstance(array, np.ndarray) and array.flags.writeable and
+            array.dtype == plan_array.dtype and array.strides == plan_array.strides and
+            array.ctypes.data % fftw_plan.input_alignment == 0)
 
-    if forward and fftshift:
-        wavefront = _fftshift(wavefront)
 
-    wavefront *= normalization
-    t3 = time.time()
-    _log.debug("    FFT_2D: FFT in {:3f} s, full function  in {:.3f} s".format(t2-t1, t3-t0))
+def _autosave_fftw_wisdom():
+    """ Save FFTW wisdom on exit, if any plans were made in this session """
+    if _FFTW_AVAILABLE and _FFTW_PLANNED and conf.autosave_fftw_wisdom:
+        from . import utils
+        utils.fftw_save_wisdom()
 
-    return wavefront
 
+atexit.register(_autosave_fftw_wisdom)
 
 
 def ispowerof2(num):
@@ -286,20 +579,17 @@ def isproductofsmallprimes(num):
     """ CLFFT only supports array sizes which are products of primes <= 13;
     Is this integer a product of primes no greater than that?
     """
-    tmp = num*1 # make copy
-    small_primes = [2,3,5,7,9,11,13]
-    for p in small_primes:
-        quotient, remainder = divmod(tmp, p)
-        while not remainder:
-            tmp = quotient
-            quotient, remainder = divmod(tmp, p)
-        if tmp==1: return True # if we get to 1 we're done
-    return False # if we don't get to 1 then it's got higher factors
+    if num < 1:
+        return False
+    for p in (2, 3, 5, 7, 11, 13):
+        while num % p == 0:
+            num //= p
+    return num == 1 # if we don't get to 1 then it's got higher factors
 
 if _OPENCL_AVAILABLE:
     def get_opencl_context():
         """ Create, save, and retrieve OpenCL handles to the GPU """
-        if len(_OPENCL_STATE) == 0:
+        if 'context' not in _OPENCL_STATE:
             platforms = pyopencl.get_platforms()
             if len(platforms) == 1:
                 _OPENCL_STATE['platform'] = platforms[0]
@@ -320,42 +610,210 @@ if _OPENCL_AVAILABLE:
             _OPENCL_STATE['queue'] = queue
         return (_OPENCL_STATE['context'], _OPENCL_STATE['queue'])
 
+    def _get_opencl_pinned(shape, dtype):
+        """ Create, save, and retrieve a pinned host array for a given array size.
 
+        This is host memory allocated by the OpenCL runtime and mapped for access from Python.
+        Transfers from it to the GPU run at about twice the speed of those from ordinary
+        pageable memory, and can run asynchronously.
+        """
+        context, queue = get_opencl_context()
+
+        def make_pinned():
+            buf = pyopencl.Buffer(context, pyopencl.mem_flags.READ_WRITE | pyopencl.mem_flags.ALLOC_HOST_PTR,
+                                  size=int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            host_array, _ = pyopencl.enqueue_map_buffer(queue, buf,
+                                                        pyopencl.map_flags.READ | pyopencl.map_flags.WRITE,
+                                                        0, shape, dtype)
+            return buf, host_array
+
+        def release_pinned(pinned):
+            buf, host_array = pinned
+            host_array.base.release(queue)  # unmap; the array's base is the pyopencl MemoryMap
+            buf.release()
+
+        return _lru_cached(_OPENCL_PINNED, (shape, dtype), make_pinned, _OPENCL_CACHE_MAX,
+                           release=release_pinned)[1]
+
+    def _get_opencl_transform(shape, dtype):
+        """ Create, save, and retrieve a clFFT transform for a given array size,
+        along with the persistent GPU array which it transforms in place.
+
+        Creating a transform generates and compiles OpenCL kernels, which takes
+        from a few to hundreds of milliseconds, so this should happen only once per size.
+        The same transform serves both directions.
+        """
+        context, queue = get_opencl_context()
+
+        def make_transform():
+            wf_on_gpu = pyopencl.array.empty(queue, shape, dtype)
+            return gpyfft.fft.FFT(context, queue, wf_on_gpu, axes=(len(shape) - 2, len(shape) - 1)), wf_on_gpu
+
+        # The dropped clFFT plan itself is destroyed by gpyfft once no longer referenced
+        return _lru_cached(_OPENCL_PLANS, (shape, dtype), make_transform, _OPENCL_CACHE_MAX,
+                           release=lambda plan: plan[1].data.release())
 
 
 
+
+
+if _NUMBA_AVAILABLE:
+    @njit(parallel=True, nogil=True, cache=True)
+    def _inplace_quadswap(a, scale):
+        """ Swap diagonally opposite quadrants of a 2D array with even dimensions,
+        in place, also multiplying it by a scale factor. For such arrays this is
+        equivalent to both fftshift and ifftshift, without writing out a second copy of the array.
+        """
+        ny = a.shape[0] // 2
+        nx = a.shape[1] // 2
+        for i in prange(ny):
+            for j in range(nx):
+                tmp = a[i, j]
+                a[i, j] = a[i + ny, j + nx] * scale
+                a[i + ny, j + nx] = tmp * scale
+                tmp = a[i, j + nx]
+                a[i, j + nx] = a[i + ny, j] * scale
+                a[i + ny, j] = tmp * scale
+
+    @njit(parallel=True, nogil=True, cache=True)
+    def _inplace_quadswap_unscaled(a):
+        """ Swap diagonally opposite quadrants of a 2D array with even dimensions, in place.
+        Same as _inplace_quadswap, without multiplying by any scale factor, so that
+        integer arrays are swapped exactly.
+        """
+        ny = a.shape[0] // 2
+        nx = a.shape[1] // 2
+        for i in prange(ny):
+            for j in range(nx):
+                tmp = a[i, j]
+                a[i, j] = a[i + ny, j + nx]
+                a[i + ny, j + nx] = tmp
+                tmp = a[i, j + nx]
+                a[i, j + nx] = a[i + ny, j]
+                a[i + ny, j] = tmp
+
+    @njit(parallel=True, fastmath=True, nogil=True, cache=True)
+    def _r_numba(x, y, out):
+        """ Compute the radius given 2D arrays x and y, into the output array """
+        for i in prange(x.shape[0]):
+            for j in range(x.shape[1]):
+                out[i, j] = math.sqrt(x[i, j] * x[i, j] + y[i, j] * y[i, j])
+
+    # Serial versions of the parallel kernels, for calls from other threads than the main one; see _numba_call
+    _NUMBA_SERIAL = {_inplace_quadswap: njit(nogil=True)(_inplace_quadswap.py_func),
+                     _inplace_quadswap_unscaled: njit(nogil=True)(_inplace_quadswap_unscaled.py_func),
+                     _r_numba: njit(fastmath=True, nogil=True)(_r_numba.py_func)}
+
+
 if  _CUDA_AVAILABLE:
+    def _cufft_call(funcname, *args):
+        """ Call a function from the cuFFT library via ctypes, raising on any nonzero status """
+        status = getattr(_CUDA_STATE['libcufft'], funcname)(*args)
+        if status != 0:
+            raise RuntimeError("{} failed with cuFFT error code {}".format(funcname, status))
+
+    def _get_cuda_stream():
+        """ Create, save, and retrieve the CUDA stream used for all FFTs and transfers """
+        if 'stream' not in _CUDA_STATE:
+            _CUDA_STATE['stream'] = cuda.stream()
+        return _CUDA_STATE['stream']
+
+    def _get_cuda_plan(shape, dtype, batch):
+        """ Create, save, and retrieve a cuFFT plan for a batch of 2D complex FFTs of a given shape and dtype.
+
+        The FFT direction is given when executing the plan, so one plan serves both
+        forward and inverse FFTs. Returns the plan handle, and the name of the cuFFT
+        function to execute it with.
+        """
+        fft_type, exec_func = _CUFFT_TYPES[np.dtype(dtype)]
+
+        def make_plan():
+            cufftplan = ctypes.c_int(0)
+            _cufft_call('cufftCreate', ctypes.byref(cufftplan))
+            try:
+                # Don't have cuFFT allocate a work area for this plan; it uses the shared one instead
+                _cufft_call('cufftSetAutoAllocation', cufftplan, 0)
+                dims = (ctypes.c_int * 2)(*shape)
+                worksize = ctypes.c_size_t(0)
+                _cufft_call('cufftMakePlanMany', cufftplan, 2, dims, None, 1, 0, None, 1, 0,
+                            fft_type, batch, ctypes.byref(worksize))
+                _cufft_call('cufftSetStream', cufftplan, _get_cuda_stream().handle)
+                _cuda_share_workarea(cufftplan, worksize.value)
+            except RuntimeError:
+                _cufft_call('cufftDestroy', cufftplan)
+                raise
+            return cufftplan.value, exec_func
+
+        return _lru_cached(_CUDA_PLANS, (tuple(shape), np.dtype(dtype), batch), make_plan, _CUDA_PLAN_CACHE_MAX,
+                           release=lambda plan: _cufft_call('cufftDestroy', plan[0]))
+
+    def _get_cuda_buffers(shape, dtype):
+        """ Create, save, and retrieve a pinned host array and a GPU array for a given array size.
+
+        Transfers from pinned (page-locked) host memory run at about twice the speed of
+        those from ordinary pageable memory, and can run asynchronously.
+        """
+        return _lru_cached(_CUDA_BUFFERS, (shape, dtype),
+                           lambda: (cuda.pinned_array(shape, dtype=dtype), cuda.device_array(shape, dtype=dtype)),
+                           _CUDA_PLAN_CACHE_MAX)
+
+
+    def _cuda_share_workarea(cufftplan, worksize):
+        """ Point a cuFFT plan, needing worksize bytes of scratch, at the GPU work area shared by all cached plans.
+
+        The plans are made without work areas of their own, so GPU scratch memory use is
+        that of the single largest plan, rather than growing with the number of cached plans.
+        All plans execute on the same stream, so they never use the shared scratch concurrently.
+        """
+        global _CUDA_WORKAREA
+        if _CUDA_WORKAREA is None or _CUDA_WORKAREA.size < worksize:
+            # (re)allocate larger, and re-point all the existing plans to the new buffer
+            _CUDA_WORKAREA = cuda.device_array(max(worksize, 1), dtype=np.uint8)
+            for plan, _ in _CUDA_PLANS.values():
+                _cufft_call('cufftSetWorkArea', plan, _CUDA_WORKAREA.device_ctypes_pointer)
+        _cufft_call('cufftSetWorkArea', cufftplan, _CUDA_WORKAREA.device_ctypes_pointer)
+
     @cuda.jit()
-    def cufftShift_2D_kernel(data, N):
+    def cufftShift_2D_kernel(data, scale):
         """
         adopted CUDA FFT shift code from:
         https://github.com/marwan-abdellah/cufftShift
         (GNU Lesser Public License)
+
+        The array is also multiplied by scale in the same pass.
+        Indexes the 2D array directly, rather than a flattened copy of it.
+        Works for any array with even dimensions, not necessarily square.
         """
 
-        # // 2D Slice & 1D Line
-        sLine = N
-        sSlice = N * N
         # // Transformations Equations
-        sEq1 = int((sSlice + sLine) / 2)
-        sEq2 = int((sSlice - sLine) / 2)
+        half_y = data.shape[0] // 2
+        half_x = data.shape[1] // 2
         x, y = cuda.grid(2)
-        # // Thread Index Converted into 1D Index
-        index = (y * N) + x
 
-        if x < N / 2:
-            if y < N / 2:
+        if y < half_y:
+            if x < half_x:
                 # // First Quad
-                temp = data[index]
-                data[index] = data[index + sEq1]
+                temp = data[y, x]
+                data[y, x] = data[y + half_y, x + half_x] * scale
                 # // Third Quad
-                data[index + sEq1] = temp
-        else:
-            if y < N / 2:
+                data[y + half_y, x + half_x] = temp * scale
+            elif x < data.shape[1]:
                 # // Second Quad
-                temp = data[index]
-                data[index] = data[index + sEq2]
-                data[index + sEq2] = temp
+                temp = data[y, x]
+                data[y, x] = data[y + half_y, x - half_x] * scale
+                data[y + half_y, x - half_x] = temp * scale
+
+    @cuda.jit()
+    def cufftShift_2D_roll_kernel(src, dst, shift_y, shift_x, scale):
+        """ Cyclically shift a 2D array of any size by (shift_y, shift_x) into dst,
+        also multiplying by scale. This handles odd array sizes, for which
+        the FFT shift can't be done by swapping pairs of elements in place.
+        """
+        x, y = cuda.grid(2)
+        ny = src.shape[0]
+        nx = src.shape[1]
+        if y < ny and x < nx:
+            dst[(y + shift_y) % ny, (x + shift_x) % nx] = src[y, x] * scale
 
 # ##################################################################
 #
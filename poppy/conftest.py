@@ -8,6 +8,29 @@ try:
 except ImportError:
     from astropy.tests.pytest_plugins import *
 
+import pytest
+
+
+@pytest.fixture(autouse=True, scope='session')
+def fftw_planner_effort():
+    """ Plan FFTW transforms with FFTW_MEASURE, rather than the slower default, since
+    the tests transform many different array sizes only a few times each. """
+    from . import conf
+    with conf.set_temp('fftw_planner_effort', 'FFTW_MEASURE'):
+        yield
+
+
+@pytest.fixture()
+def double_precision(request):
+    """ Run a test in double precision rather than the default single precision,
+    for tests whose numerical tolerances assume it.
+    Use via @pytest.mark.usefixtures('double_precision'), or to run a test in both precisions,
+    @pytest.mark.parametrize('double_precision', [True, False], indirect=True). """
+    from . import conf
+    use_double = getattr(request, 'param', True)
+    with conf.set_temp('double_precision', use_double):
+        yield use_double
+
 ## Uncomment the following line to treat all DeprecationWarnings as
 ## exceptions
 # enable_deprecations_as_exceptions()
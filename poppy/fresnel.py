@@ -514,23 +514,22 @@ class FresnelWavefront(BaseWavefront):
         _log.debug(
             "Propagation Parameters: k={0:0.2e},".format(k) + "S={0:0.2e},".format(s) + "z={0:0.2e},".format(z_direct))
 
-        # TODO the following exponential code could be accelerated with numexpr
-        quadphase_1st = np.exp(1.0j * k * (x ** 2 + y ** 2) / (2 * z_direct))  # eq. 6.68
-        quadphase_2nd = np.exp(1.0j * k * z_direct) / (1.0j * self.wavelength.to(u.m).value * z_direct) * np.exp(
-            1.0j * k * (x ** 2 + y ** 2) / (2 * z_direct))  # eq. 6.70
+        quadphase = accel_math._quadphase(x, y, k / (2 * z_direct))  # eq. 6.68
+        # the quadratic phase in eq. 6.70 is the same, up to a constant factor:
+        quadphase_2nd_factor = np.exp(1.0j * k * z_direct) / (1.0j * self.wavelength.to(u.m).value * z_direct)
 
-        stage1 = self.wavefront * quadphase_1st  # eq.6.67
+        stage1 = self.wavefront * quadphase  # eq.6.67
         if z_direct > 0:
             result = accel_math._ifftshift(stage1)
             result = accel_math.fft_2d(result, forward=True, fftshift=False)
             result = accel_math._fftshift(result)
-            result *= self.pixelscale.to(u.m / u.pix).value ** 2  # eq.6.69 and #6.80
+            result *= self.pixelscale.to(u.m / u.pix).value ** 2 * quadphase_2nd_factor  # eq.6.69 and #6.80
         else:
             result = accel_math._fftshift(stage1)
             result = accel_math.fft_2d(result, forward=False, fftshift=False)
             result = accel_math._ifftshift(result)
-            result *= self.pixelscale.to(u.m / u.pix).value ** 2 * self.n ** 2
-        result *= quadphase_2nd
+            result *= self.pixelscale.to(u.m / u.pix).value ** 2 * self.n ** 2 * quadphase_2nd_factor
+        result *= quadphase  # eq. 6.70
 
         self.pixelscale = self.wavelength * abs(z) / s / u.pix
         self.wavefront = result
@@ -11,6 +11,7 @@ from .. import accel_math
 from .. import optics
 
 @pytest.mark.skipif(accel_math._NUMEXPR_AVAILABLE is False, reason="numexpr not available")
+@pytest.mark.usefixtures('double_precision')
 def test_MFT_MFTwithnumexpr_equivalence(display=False, displaycrop=None):
     """ Test that the basic MFT transform is numerically equivalent to the
     version accelerated with NUMEXPR, and both match the FFT if calculated on the correct sampling. """
@@ -44,11 +45,14 @@ def test_MFT_MFTwithnumexpr_equivalence(display=False, displaycrop=None):
 
 
 @pytest.mark.skipif(accel_math._NUMEXPR_AVAILABLE is False, reason="numexpr not available")
-def test_r():
+def test_r(monkeypatch):
     """ Test that calculating the radius gives equivalent results via
     plain numpy and numexpr"""
     y, x = np.indices((10,20))
 
+    # otherwise Numba would be used for arrays this small, with or without numexpr
+    monkeypatch.setattr(accel_math, '_USE_NUMBA', False)
+
     default_use_numexpr = accel_math._USE_NUMEXPR
 
     accel_math._USE_NUMEXPR = True
@@ -82,3 +86,137 @@ def test_exp():
 def test_benchmark_fft():
     # minimalist case for speed, but at least it tests the function:
     accel_math.benchmark_fft(npix=512, iterations=2)
+
+def test_fftshift(monkeypatch):
+    """ Test that the CPU FFT shifts by block copies match numpy's, for
+    both even and odd array sizes, with and without a scale factor"""
+    monkeypatch.setattr(accel_math, '_USE_CUDA', False)
+    monkeypatch.setattr(accel_math, '_USE_NUMBA', False)
+    for shape in [(8, 8), (7, 7), (6, 9)]:
+        a = np.random.random(shape) + 1j * np.random.random(shape)
+        np.testing.assert_array_equal(accel_math._fftshift(a.copy()), np.fft.fftshift(a))
+        np.testing.assert_array_equal(accel_math._ifftshift(a.copy()), np.fft.ifftshift(a))
+        np.testing.assert_allclose(accel_math._fftshift(a.copy(), scale=0.5), np.fft.fftshift(a) * 0.5)
+        np.testing.assert_allclose(accel_math._ifftshift(a.copy(), scale=0.5), np.fft.ifftshift(a) * 0.5)
+
+@pytest.mark.skipif(accel_math._NUMBA_AVAILABLE is False, reason="numba not available")
+def test_fftshift_numba(monkeypatch):
+    """ Test that the Numba in-place quadrant swap matches numpy's FFT shifts
+    for even array sizes"""
+    monkeypatch.setattr(accel_math, '_USE_NUMBA', True)
+
+    for shape in [(8, 8), (6, 10)]:
+        a = np.random.random(shape) + 1j * np.random.random(shape)
+        np.testing.assert_array_equal(accel_math._fftshift(a.copy()), np.fft.fftshift(a))
+        np.testing.assert_array_equal(accel_math._ifftshift(a.copy()), np.fft.ifftshift(a))
+
+    # without a scale factor, integers too large to be exact as floats are still shifted exactly
+    a = np.arange(2**53, 2**53 + 60, dtype=np.int64).reshape(6, 10)
+    np.testing.assert_array_equal(accel_math._fftshift(a.copy()), np.fft.fftshift(a))
+
+@pytest.mark.skipif(accel_math._NUMEXPR_AVAILABLE is False, reason="numexpr not available")
+def test_quadphase(monkeypatch):
+    """ Test that calculating a quadratic phase gives equivalent results via
+    plain numpy and numexpr"""
+    y, x = np.indices((10,20)) * 0.1
+
+    monkeypatch.setattr(accel_math, '_USE_NUMEXPR', True)
+    r1 = accel_math._quadphase(x, y, 2.5)
+
+    monkeypatch.setattr(accel_math, '_USE_NUMEXPR', False)
+    r2 = accel_math._quadphase(x, y, 2.5)
+
+    np.testing.assert_almost_equal(r1,r2)
+
+@pytest.mark.skipif(accel_math._NUMBA_AVAILABLE is False, reason="numba not available")
+def test_r_numba(monkeypatch):
+    """ Test that calculating the radius gives equivalent results via
+    plain numpy and numba"""
+    y, x = np.indices((10,20))
+
+    monkeypatch.setattr(accel_math, '_USE_NUMEXPR', False)
+
+    monkeypatch.setattr(accel_math, '_USE_NUMBA', True)
+    r1 = accel_math._r(x,y)
+
+    monkeypatch.setattr(accel_math, '_USE_NUMBA', False)
+    r2 = accel_math._r(x,y)
+
+    np.testing.assert_almost_equal(r1,r2)
+
+@pytest.mark.skipif(accel_math._FFTW_AVAILABLE is False, reason="pyfftw not available")
+def test_fft_2d_fftw(monkeypatch):
+    """ Test that forward and inverse FFTs give equivalent results via
+    plain numpy and FFTW, including on repeated calls using the saved plans"""
+    for i in range(2):
+        a = np.random.random((32, 32)) + 1j * np.random.random((32, 32))
+        for forward in [True, False]:
+            monkeypatch.setattr(accel_math, '_USE_FFTW', True)
+            r1 = accel_math.fft_2d(a.copy(), forward=forward)
+
+            monkeypatch.setattr(accel_math, '_USE_FFTW', False)
+            r2 = accel_math.fft_2d(a.copy(), forward=forward)
+
+            np.testing.assert_almost_equal(r1,r2)
+
+def test_fft_2d_batch():
+    """ Test that a batched FFT of a stack of arrays matches
+    separate FFTs of each array"""
+    stack = np.random.random((3, 16, 16)) + 1j * np.random.random((3, 16, 16))
+    for forward in [True, False]:
+        batched = accel_math.fft_2d_batch(stack.copy(), forward=forward)
+        for i in range(stack.shape[0]):
+            np.testing.assert_almost_equal(batched[i], accel_math.fft_2d(stack[i].copy(), forward=forward))
+
+    with pytest.raises(ValueError):
+        accel_math.fft_2d_batch(stack[0])
+
+def test_fft_2d_normalization():
+    """ Test that the normalization applied by fft_2d is the same whether or not
+    it is folded into the FFT shift, for both even and odd array sizes"""
+    for n in [16, 15]:
+        a = np.random.random((n, n)) + 1j * np.random.random((n, n))
+        forward_expected = np.fft.fft2(a) / n
+        np.testing.assert_almost_equal(accel_math.fft_2d(a.copy(), fftshift=False), forward_expected)
+        np.testing.assert_almost_equal(accel_math.fft_2d(a.copy(), fftshift=True),
+                                       np.fft.fftshift(forward_expected))
+
+        inverse_expected = np.fft.ifft2(np.fft.ifftshift(a)) * n
+        np.testing.assert_almost_equal(accel_math.fft_2d(a.copy(), forward=False, fftshift=True),
+                                       inverse_expected)
+
+def test_fft_2d_threads():
+    """ Test that FFTs run concurrently from several threads match
+    the same FFTs run one at a time"""
+    import concurrent.futures
+    arrays = [np.random.random((32, 32)) + 1j * np.random.random((32, 32)) for i in range(8)]
+    expected = [accel_math.fft_2d(a.copy()) for a in arrays]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda a: accel_math.fft_2d(a.copy()), arrays))
+    for r, e in zip(results, expected):
+        np.testing.assert_almost_equal(r, e)
+
+@pytest.mark.skipif(accel_math._FFTW_AVAILABLE is False, reason="pyfftw not available")
+def test_fft_2d_fftw_alignment(monkeypatch):
+    """ Test that FFTW FFTs are correct whether or not the array
+    matches the alignment and strides of the cached plan"""
+    import pyfftw
+    monkeypatch.setattr(accel_math, '_USE_FFTW', True)
+
+    a = np.random.random((32, 32)) + 1j * np.random.random((32, 32))
+    expected = np.fft.fftshift(np.fft.fft2(a)) / 32
+
+    aligned = pyfftw.empty_aligned(a.shape, dtype=a.dtype)
+    aligned[:] = a
+    misaligned = np.empty(a.nbytes + 8, dtype=np.uint8)[8:].view(a.dtype).reshape(a.shape)
+    misaligned[:] = a
+    transposed = a.T.copy().T
+    for arr in [aligned, misaligned, transposed]:
+        np.testing.assert_almost_equal(accel_math.fft_2d(arr), expected)
+
+def test_isproductofsmallprimes():
+    """ Test the check for array sizes supported by clFFT """
+    for n in [1, 2, 512, 1536, 2880, 3*3*7*11*13, 1024*13]:
+        assert accel_math.isproductofsmallprimes(n)
+    for n in [0, 17, 2*17, 1021, 2*3*5*7*11*13*19]:
+        assert not accel_math.isproductofsmallprimes(n)
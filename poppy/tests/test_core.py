@@ -179,9 +179,10 @@ def test_multiwavelength_opticalsystem():
     return psf
 
 
-def test_normalization():
+@pytest.mark.parametrize('double_precision, tol', [(True, 1e-9), (False, 1e-6)], indirect=['double_precision'])
+def test_normalization(double_precision, tol):
     """ Test that we can compute a PSF and get the desired flux,
-    depending on the normalization """
+    depending on the normalization, to within tol for the floating point precision used """
     osys = poppy_core.OpticalSystem("test", oversample=2)
     pupil = optics.CircularAperture(radius=6.5/2)
     osys.add_pupil(pupil) #function='Circle', radius=6.5/2)
@@ -194,7 +195,7 @@ def test_normalization():
 
     # this should be very very close to one
     psf_last = osys.calc_psf(wavelength=1.0e-6, normalize='last')
-    assert abs(psf_last[0].data.sum() - 1) < 0.01
+    assert abs(psf_last[0].data.sum() - 1) < tol
 
     # this should be a little further but still pretty close
     psf_first = osys.calc_psf(wavelength=1.0e-6, normalize='first')
@@ -203,7 +204,7 @@ def test_normalization():
 
     # for the simple optical system above, the 'first' and 'exit_pupil' options should be equivalent:
     psf_exit_pupil = osys.calc_psf(wavelength=1.0e-6, normalize='exit_pupil')
-    assert (psf_exit_pupil[0].data.sum() - 1) < 1e-9
+    assert (psf_exit_pupil[0].data.sum() - 1) < tol
     assert np.abs( psf_exit_pupil[0].data - psf_first[0].data).max()  < 1e-10
 
 
@@ -218,7 +219,7 @@ def test_normalization():
     psf_small_pupil_exit  = osys2.calc_psf(wavelength=1.0e-6, normalize='exit_pupil')
     psf_small_pupil_last  = osys2.calc_psf(wavelength=1.0e-6, normalize='last')
     # normalized for the output to 1 we should of course get 1
-    assert abs(psf_small_pupil_last[0].data.sum() - 1) < 1e-9
+    assert abs(psf_small_pupil_last[0].data.sum() - 1) < tol
     # normalized to the exit pupil we should get near but not exactly 1 (due to finite FOV)
     assert abs(psf_small_pupil_exit[0].data.sum() - 1) < 0.01
     assert abs(psf_small_pupil_exit[0].data.sum() - 1) > 0.0001
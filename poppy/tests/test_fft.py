@@ -54,6 +54,7 @@ def test_fft_normalization():
     assert abs(psf[0].data.sum() - 0.9977) < 0.001
 
 
+@pytest.mark.usefixtures('double_precision')
 def test_fft_blc_coronagraph():
     """ Test that a simple band limited coronagraph blocks most of the light """
 
@@ -170,7 +171,7 @@ def test_parity_FFT_forward_inverse(display=False):
 # Test different FFT algorithms for consistency:
 #    - numpy
 #    - fftw
-#    - CUDA / pyculib
+#    - CUDA / cuFFT
 #    - OpenCL / clfft / gpyfft
 #
 # The test method is the same for all: calculate PSFs for an
@@ -8,6 +8,7 @@ from poppy.poppy_core import _log, PlaneType
 import astropy.units as u
 import matplotlib.pyplot as plt
 import numpy as np
+import pytest
 from .. import fwcentroid
 from scipy.ndimage import zoom,shift
 
@@ -220,8 +221,11 @@ def test_Circular_Aperture_PTP_short(display=False, npix=512, display_proper=Fal
     diff=shifted/shifted.max()-zoomed/zoomed.max()
     assert(diff.max() < 1e-3)
 
-def test_spherical_lens(display=False):
-    """Make sure that spherical lens operator is working.
+@pytest.mark.parametrize('double_precision, dtype, tol',
+                         [(True, np.complex128, 1e-11), (False, np.complex64, 1e-9)],
+                         indirect=['double_precision'])
+def test_spherical_lens(double_precision, dtype, tol, display=False):
+    """Make sure that spherical lens operator is working, in both double and single precision.
 
     Comparison values were taken from a simple PROPER model, implemented in IDL:
         sampling=1
@@ -242,12 +246,13 @@ def test_spherical_lens(display=False):
     wavefront = fresnel.FresnelWavefront(beam_radius=beam_diameter/2.,
                                    wavelength=500.0e-9, npix=256,
                                    oversample=1)
+    assert wavefront.wavefront.dtype == dtype
     diam = beam_diameter
     lens = fresnel.QuadraticLens(fl, name='M1')
     wavefront.apply_lens_power(lens)
-    #IDL/PROPER results should be within 10^(-11).
-    assert  1e-11 > abs(np.mean(wavefront.phase)-proper_wavefront_mean)
-    assert  1e-11 > abs(np.max(wavefront.phase)-proper_phase_max)
+    #IDL/PROPER results should be within 10^(-11), or 10^(-9) in single precision.
+    assert  tol > abs(np.mean(wavefront.phase)-proper_wavefront_mean)
+    assert  tol > abs(np.max(wavefront.phase)-proper_phase_max)
 
 def test_fresnel_optical_system_Hubble(display=False, sampling=2):
     """ Test the FresnelOpticalSystem infrastructure
@@ -448,6 +453,7 @@ def test_fresnel_FITS_Optical_element(tmpdir, display=False, verbose=False):
             print("Tests of FITSOpticalElement in FresnelOpticalSystem pass.")
 
 
+@pytest.mark.usefixtures('double_precision')
 def test_fresnel_propagate_direct_forward_and_back():
     npix = 1024
     wavelen = 2200 * u.nm
@@ -462,6 +468,7 @@ def test_fresnel_propagate_direct_forward_and_back():
     np.testing.assert_almost_equal(wf.wavefront, start)
 
 
+@pytest.mark.usefixtures('double_precision')
 def test_fresnel_propagate_direct_back_and_forward():
     npix = 1024
     wavelen = 2200 * u.nm
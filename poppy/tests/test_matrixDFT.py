@@ -4,6 +4,7 @@
 #
 
 import numpy as np
+import pytest
 import matplotlib
 import matplotlib.pyplot as plt
 import astropy.io.fits as fits
@@ -574,6 +575,7 @@ def test_parity_MFT_forward_inverse(display = False):
         plt.colorbar()
         print(maxabsdiff)
 
+@pytest.mark.usefixtures('double_precision')
 def test_MFT_FFT_equivalence(display=False, displaycrop=None):
     """ Test that the MFT transform is numerically equivalent to the
     FFT, if calculated on the correct sampling. """
@@ -633,6 +635,7 @@ def test_MFT_FFT_equivalence(display=False, displaycrop=None):
 
         return mftout, fftout
 
+@pytest.mark.usefixtures('double_precision')
 def test_MFT_FFT_equivalence_in_OpticalSystem(display=False):
     """ Test that propagating Wavefronts through an OpticalSystem
     using an MFT and an FFT give equivalent results.
@@ -2,6 +2,7 @@
 
 import matplotlib.pyplot as pl
 import numpy as np
+import pytest
 import astropy.io.fits as fits
 import astropy.units as u
 
@@ -24,6 +25,7 @@ wavelength=1e-6
 #def test_Rotation():
 #    pass
 
+@pytest.mark.usefixtures('double_precision')
 def test_InverseTransmission():
     """ Verify this inverts the optic throughput appropriately"""
     wave = poppy_core.Wavefront(npix=100, wavelength=wavelength)
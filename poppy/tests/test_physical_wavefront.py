@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 import astropy.units as u
 
 from .. import poppy_core
@@ -28,6 +29,7 @@ def test_GaussianBeamParams():
     assert(np.round(gw.z_r.value, 9) == np.round(0.042688650889351865, 9))
     # FIXME MP: where do the above values come from?
 
+@pytest.mark.usefixtures('double_precision')
 def test_power():
     """Confirm that the power is scaled correctly."""
     
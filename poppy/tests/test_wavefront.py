@@ -2,6 +2,7 @@
 from .. import poppy_core
 from .. import optics
 import numpy as np
+import pytest
 import astropy.io.fits as fits
 from .test_core import check_wavefront
 import astropy.units as u
@@ -27,6 +28,7 @@ def test_wavefront_in_arcsec():
     assert wave.shape[1] == 50
     assert wave.planetype == poppy_core._IMAGE
 
+@pytest.mark.usefixtures('double_precision')
 def test_wavefront_coordinates():
     wave = poppy_core.Wavefront(npix=50, pixelscale=0.2, wavelength=wavelength)
     assert wave.coordinates()[0].shape[0]== 50